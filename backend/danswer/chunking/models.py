@@ -1,9 +1,9 @@
 import inspect
-import json
 from dataclasses import dataclass
 from typing import Any
 from typing import cast
 
+import orjson
 from danswer.connectors.models import Document
 
 
@@ -44,7 +44,7 @@ class InferenceChunk(BaseChunk):
         if "source_links" in init_kwargs:
             source_links = init_kwargs["source_links"]
             source_links_dict = (
-                json.loads(source_links)
+                orjson.loads(source_links)
                 if isinstance(source_links, str)
                 else source_links
             )
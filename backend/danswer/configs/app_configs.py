@@ -67,6 +67,12 @@ TYPESENSE_DEFAULT_COLLECTION = os.environ.get(
     "TYPESENSE_DEFAULT_COLLECTION", "danswer_index"
 )
 TYPESENSE_API_KEY = os.environ.get("TYPESENSE_API_KEY", "")
+# Number of chunks sent per Typesense import request. Each indexing pipeline call covers
+# INDEX_BATCH_SIZE documents, typically tens to a few hundred chunks, so larger calls are
+# split into a few imports which are sent concurrently. Raise it for bulk loading.
+TYPESENSE_IMPORT_BATCH_SIZE = int(os.environ.get("TYPESENSE_IMPORT_BATCH_SIZE", 100))
+# Max number of Typesense import requests in flight at once
+TYPESENSE_IMPORT_CONCURRENCY = int(os.environ.get("TYPESENSE_IMPORT_CONCURRENCY", 4))
 # Number of documents in a batch during indexing (further batching done by chunks before passing to bi-encoder)
 INDEX_BATCH_SIZE = 16
 
@@ -1,5 +1,5 @@
 import uuid
-from collections.abc import Callable
+from collections.abc import Sequence
 from copy import deepcopy
 
 from danswer.chunking.models import EmbeddedIndexChunk
@@ -29,40 +29,55 @@ def get_uuid_from_chunk(
     return uuid.uuid5(uuid.NAMESPACE_X500, unique_identifier_string)
 
 
-# Takes the chunk identifier returns whether the chunk exists and the user/group whitelists
-WhitelistCallable = Callable[[str], tuple[bool, list[str], list[str]]]
+# Maps the identifier of a document's first chunk to the existing user/group whitelists
+# Documents whose first chunk is not yet in the document store are absent from the mapping
+ChunkWhitelistMap = dict[str, tuple[list[str], list[str]]]
+
+
+def get_first_chunk_ids(
+    chunks: Sequence[IndexChunk], chunk_uuids: Sequence[str] | None = None
+) -> list[str]:
+    """Returns the identifiers of the first chunk seen of each document, these are the chunks
+    whose whitelists update_doc_user_map needs. chunk_uuids can be passed if already computed.
+    """
+    first_chunk_ids: dict[str, str] = {}
+    for ind, chunk in enumerate(chunks):
+        if chunk.source_document.id not in first_chunk_ids:
+            first_chunk_ids[chunk.source_document.id] = (
+                chunk_uuids[ind] if chunk_uuids else str(get_uuid_from_chunk(chunk))
+            )
+    return list(first_chunk_ids.values())
 
 
 def update_doc_user_map(
     chunk: IndexChunk | EmbeddedIndexChunk,
     doc_whitelist_map: dict[str, dict[str, list[str]]],
-    doc_store_whitelist_fnc: WhitelistCallable,
+    existing_whitelists: ChunkWhitelistMap,
     user_str: str,
+    precomputed_uuid: str | None = None,
 ) -> tuple[dict[str, dict[str, list[str]]], bool]:
     """Returns an updated document id to whitelists mapping and if the document's chunks need to be wiped."""
     doc_whitelist_map = deepcopy(doc_whitelist_map)
-    first_chunk_uuid = str(get_uuid_from_chunk(chunk))
     document = chunk.source_document
     if document.id not in doc_whitelist_map:
-        first_chunk_found, whitelist_users, whitelist_groups = doc_store_whitelist_fnc(
-            first_chunk_uuid
-        )
-
-        if not first_chunk_found:
+        first_chunk_uuid = precomputed_uuid or str(get_uuid_from_chunk(chunk))
+        if first_chunk_uuid not in existing_whitelists:
             doc_whitelist_map[document.id] = {
                 ALLOWED_USERS: [user_str],
                 # TODO introduce groups logic here
-                ALLOWED_GROUPS: whitelist_groups,
+                ALLOWED_GROUPS: [],
             }
             # First chunk does not exist so document does not exist, no need for deletion
             return doc_whitelist_map, False
         else:
+            whitelist_users, whitelist_groups = existing_whitelists[first_chunk_uuid]
+            whitelist_users = list(whitelist_users)
             if user_str not in whitelist_users:
                 whitelist_users.append(user_str)
             # TODO introduce groups logic here
             doc_whitelist_map[document.id] = {
                 ALLOWED_USERS: whitelist_users,
-                ALLOWED_GROUPS: whitelist_groups,
+                ALLOWED_GROUPS: list(whitelist_groups),
             }
             # First chunk exists, but with update, there may be less total chunks now
             # Must delete rest of document chunks
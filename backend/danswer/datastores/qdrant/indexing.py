@@ -1,4 +1,3 @@
-from functools import partial
 from uuid import UUID
 
 from danswer.chunking.models import EmbeddedIndexChunk
@@ -14,7 +13,9 @@ from danswer.configs.constants import SEMANTIC_IDENTIFIER
 from danswer.configs.constants import SOURCE_LINKS
 from danswer.configs.constants import SOURCE_TYPE
 from danswer.configs.model_configs import DOC_EMBEDDING_DIM
+from danswer.datastores.datastore_utils import ChunkWhitelistMap
 from danswer.datastores.datastore_utils import DEFAULT_BATCH_SIZE
+from danswer.datastores.datastore_utils import get_first_chunk_ids
 from danswer.datastores.datastore_utils import get_uuid_from_chunk
 from danswer.datastores.datastore_utils import update_doc_user_map
 from danswer.utils.clients import get_qdrant_client
@@ -50,22 +51,25 @@ def create_qdrant_collection(
 
 
 def get_qdrant_document_whitelists(
-    doc_chunk_id: str, collection_name: str, q_client: QdrantClient
-) -> tuple[bool, list[str], list[str]]:
-    """Get whether a document is found and the existing whitelists"""
+    doc_chunk_ids: list[str], collection_name: str, q_client: QdrantClient
+) -> ChunkWhitelistMap:
+    """Get the existing whitelists of the chunks which are found, in a single request"""
+    if not doc_chunk_ids:
+        return {}
     results = q_client.retrieve(
         collection_name=collection_name,
-        ids=[doc_chunk_id],
+        ids=doc_chunk_ids,
         with_payload=[ALLOWED_USERS, ALLOWED_GROUPS],
     )
-    if len(results) == 0:
-        return False, [], []
-    payload = results[0].payload
-    if not payload:
-        raise RuntimeError(
-            "Qdrant Index is corrupted, Document found with no access lists."
-        )
-    return True, payload[ALLOWED_USERS], payload[ALLOWED_GROUPS]
+    whitelists: ChunkWhitelistMap = {}
+    for result in results:
+        payload = result.payload
+        if not payload:
+            raise RuntimeError(
+                "Qdrant Index is corrupted, Document found with no access lists."
+            )
+        whitelists[str(result.id)] = (payload[ALLOWED_USERS], payload[ALLOWED_GROUPS])
+    return whitelists
 
 
 def delete_qdrant_doc_chunks(
@@ -102,18 +106,14 @@ def index_qdrant_chunks(
     point_structs: list[PointStruct] = []
     # Maps document id to dict of whitelists for users/groups each containing list of users/groups as strings
     doc_user_map: dict[str, dict[str, list[str]]] = {}
+    existing_whitelists = get_qdrant_document_whitelists(
+        get_first_chunk_ids(chunks), collection, q_client
+    )
     docs_deleted = 0
     for chunk in chunks:
         document = chunk.source_document
         doc_user_map, delete_doc = update_doc_user_map(
-            chunk,
-            doc_user_map,
-            partial(
-                get_qdrant_document_whitelists,
-                collection_name=collection,
-                q_client=q_client,
-            ),
-            user_str,
+            chunk, doc_user_map, existing_whitelists, user_str
         )
 
         if delete_doc:
@@ -1,13 +1,19 @@
-import json
-from functools import partial
+import asyncio
+from collections import defaultdict
+from functools import lru_cache
+from itertools import islice
+from time import monotonic
 from typing import Any
 from uuid import UUID
 
-import typesense  # type: ignore
+import httpx
+import orjson
 from danswer.chunking.models import EmbeddedIndexChunk
 from danswer.chunking.models import IndexChunk
 from danswer.chunking.models import InferenceChunk
 from danswer.configs.app_configs import TYPESENSE_DEFAULT_COLLECTION
+from danswer.configs.app_configs import TYPESENSE_IMPORT_BATCH_SIZE
+from danswer.configs.app_configs import TYPESENSE_IMPORT_CONCURRENCY
 from danswer.configs.constants import ALLOWED_GROUPS
 from danswer.configs.constants import ALLOWED_USERS
 from danswer.configs.constants import BLURB
@@ -19,27 +25,73 @@ from danswer.configs.constants import SECTION_CONTINUATION
 from danswer.configs.constants import SEMANTIC_IDENTIFIER
 from danswer.configs.constants import SOURCE_LINKS
 from danswer.configs.constants import SOURCE_TYPE
-from danswer.datastores.datastore_utils import DEFAULT_BATCH_SIZE
+from danswer.datastores.datastore_utils import ChunkWhitelistMap
+from danswer.datastores.datastore_utils import get_first_chunk_ids
 from danswer.datastores.datastore_utils import get_uuid_from_chunk
 from danswer.datastores.datastore_utils import update_doc_user_map
 from danswer.datastores.interfaces import IndexFilter
 from danswer.datastores.interfaces import KeywordIndex
+from danswer.utils.clients import get_typesense_async_client
 from danswer.utils.clients import get_typesense_client
+from danswer.utils.clients import run_on_typesense_loop
+from danswer.utils.clients import send_typesense_request
 from danswer.utils.logging import setup_logger
 from typesense.exceptions import ObjectNotFound  # type: ignore
 
 
 logger = setup_logger()
 
+_COLLECTION_SCHEMA_FIELDS: tuple[dict[str, str], ...] = (
+    # Typesense uses "id" type string as a special field
+    {"name": "id", "type": "string"},
+    {"name": DOCUMENT_ID, "type": "string"},
+    {"name": CHUNK_ID, "type": "int32"},
+    {"name": BLURB, "type": "string"},
+    {"name": CONTENT, "type": "string"},
+    {"name": SOURCE_TYPE, "type": "string"},
+    {"name": SOURCE_LINKS, "type": "string"},
+    {"name": SEMANTIC_IDENTIFIER, "type": "string"},
+    {"name": SECTION_CONTINUATION, "type": "bool"},
+    {"name": ALLOWED_USERS, "type": "string[]"},
+    {"name": ALLOWED_GROUPS, "type": "string[]"},
+)
+# Collection name to the last time it was seen to exist
+_collection_exists_cache: dict[str, float] = {}
+_COLLECTION_EXISTS_TTL = 300  # 5 minutes
+# Typesense caps the number of hits returned per page of a search
+_TYPESENSE_MAX_PER_PAGE = 250
+# Large imports are processed for a while before Typesense responds
+_TYPESENSE_IMPORT_TIMEOUT = httpx.Timeout(5.0, read=300.0)
+# Fields needed to build an InferenceChunk, the access lists are left out of search hits
+_INFERENCE_CHUNK_FIELDS = ",".join(
+    [
+        DOCUMENT_ID,
+        CHUNK_ID,
+        BLURB,
+        CONTENT,
+        SOURCE_TYPE,
+        SOURCE_LINKS,
+        SEMANTIC_IDENTIFIER,
+        SECTION_CONTINUATION,
+    ]
+)
+
 
 def check_typesense_collection_exist(
     collection_name: str = TYPESENSE_DEFAULT_COLLECTION,
 ) -> bool:
+    # Collections are rarely created/dropped at runtime, only recheck every so often
+    last_seen = _collection_exists_cache.get(collection_name)
+    if last_seen is not None and monotonic() - last_seen < _COLLECTION_EXISTS_TTL:
+        return True
+
     client = get_typesense_client()
     try:
         client.collections[collection_name].retrieve()
     except ObjectNotFound:
+        _collection_exists_cache.pop(collection_name, None)
         return False
+    _collection_exists_cache[collection_name] = monotonic()
     return True
 
 
@@ -49,154 +101,287 @@ def create_typesense_collection(
     ts_client = get_typesense_client()
     collection_schema = {
         "name": collection_name,
-        "fields": [
-            # Typesense uses "id" type string as a special field
-            {"name": "id", "type": "string"},
-            {"name": DOCUMENT_ID, "type": "string"},
-            {"name": CHUNK_ID, "type": "int32"},
-            {"name": BLURB, "type": "string"},
-            {"name": CONTENT, "type": "string"},
-            {"name": SOURCE_TYPE, "type": "string"},
-            {"name": SOURCE_LINKS, "type": "string"},
-            {"name": SEMANTIC_IDENTIFIER, "type": "string"},
-            {"name": SECTION_CONTINUATION, "type": "bool"},
-            {"name": ALLOWED_USERS, "type": "string[]"},
-            {"name": ALLOWED_GROUPS, "type": "string[]"},
-        ],
+        "fields": list(_COLLECTION_SCHEMA_FIELDS),
     }
     ts_client.collections.create(collection_schema)
+    _collection_exists_cache[collection_name] = monotonic()
 
 
-def get_typesense_document_whitelists(
-    doc_chunk_id: str, collection_name: str, ts_client: typesense.Client
-) -> tuple[bool, list[str], list[str]]:
-    """Returns whether the document already exists and the users/group whitelists"""
-    try:
-        document = (
-            ts_client.collections[collection_name].documents[doc_chunk_id].retrieve()
-        )
-    except ObjectNotFound:
-        return False, [], []
-    if document[ALLOWED_USERS] is None or document[ALLOWED_GROUPS] is None:
-        raise RuntimeError(
-            "Typesense Index is corrupted, Document found with no access lists."
+async def get_typesense_document_whitelists(
+    doc_chunk_ids: list[str], collection_name: str, ts_client: httpx.AsyncClient
+) -> ChunkWhitelistMap:
+    """Returns the users/group whitelists of the chunks which already exist, all chunks
+    are fetched in a single multi_search request"""
+    if not doc_chunk_ids:
+        return {}
+    searches = [
+        {
+            "collection": collection_name,
+            "q": "*",
+            "filter_by": f"id:=[{','.join(id_batch)}]",
+            "include_fields": f"id,{ALLOWED_USERS},{ALLOWED_GROUPS}",
+            "per_page": len(id_batch),
+        }
+        for id_batch in (
+            doc_chunk_ids[x : x + _TYPESENSE_MAX_PER_PAGE]
+            for x in range(0, len(doc_chunk_ids), _TYPESENSE_MAX_PER_PAGE)
         )
-    return True, document[ALLOWED_USERS], document[ALLOWED_GROUPS]
+    ]
+    response = await send_typesense_request(
+        ts_client, "POST", "/multi_search", json={"searches": searches}
+    )
+    response.raise_for_status()
 
+    whitelists: ChunkWhitelistMap = {}
+    for search_result in orjson.loads(response.content)["results"]:
+        if "error" in search_result:
+            raise RuntimeError(
+                f"Typesense whitelist lookup failed: {search_result['error']}"
+            )
+        for hit in search_result["hits"]:
+            document = hit["document"]
+            if (
+                document.get(ALLOWED_USERS) is None
+                or document.get(ALLOWED_GROUPS) is None
+            ):
+                raise RuntimeError(
+                    "Typesense Index is corrupted, Document found with no access lists."
+                )
+            whitelists[document["id"]] = (
+                document[ALLOWED_USERS],
+                document[ALLOWED_GROUPS],
+            )
+    return whitelists
 
-def delete_typesense_doc_chunks(
-    document_id: str, collection_name: str, ts_client: typesense.Client
+
+async def delete_typesense_doc_chunks(
+    document_ids: list[str],
+    collection_name: str,
+    ts_client: httpx.AsyncClient,
+    min_chunk_id: int = 0,
 ) -> bool:
-    doc_id_filter = {"filter_by": f"{DOCUMENT_ID}:'{document_id}'"}
+    """Deletes the chunks of the given documents in a single request, only chunks
+    from min_chunk_id onwards are removed"""
+    if not document_ids:
+        return False
+    # Backticks escape the ids as they may contain commas (i.e. urls)
+    ids_str = ",".join(f"`{document_id}`" for document_id in document_ids)
+    filter_str = f"{DOCUMENT_ID}:=[{ids_str}]"
+    if min_chunk_id > 0:
+        filter_str += f" && {CHUNK_ID}:>={min_chunk_id}"
+    doc_id_filter = {"filter_by": filter_str}
 
     # Typesense doesn't seem to prioritize individual deletions, problem not seen with this approach
     # Point to consider if we see instances of number of Typesense and Qdrant docs not matching
-    del_result = ts_client.collections[collection_name].documents.delete(doc_id_filter)
-    return del_result["num_deleted"] != 0
+    response = await send_typesense_request(
+        ts_client,
+        "DELETE",
+        f"/collections/{collection_name}/documents",
+        params=doc_id_filter,
+    )
+    response.raise_for_status()
+    return response.json()["num_deleted"] != 0
+
+
+async def _import_typesense_batch(
+    doc_batch: list[bytes],
+    collection_name: str,
+    ts_client: httpx.AsyncClient,
+    import_limiter: asyncio.Semaphore,
+) -> None:
+    # Import endpoint takes and returns JSONL, one line per document
+    async with import_limiter:
+        # Upserts are idempotent so a failed import is safe to send again
+        response = await send_typesense_request(
+            ts_client,
+            "POST",
+            f"/collections/{collection_name}/documents/import",
+            params={"action": "upsert"},
+            content=b"\n".join(doc_batch),
+            timeout=_TYPESENSE_IMPORT_TIMEOUT,
+        )
+    response.raise_for_status()
+    results = (orjson.loads(line) for line in response.content.splitlines() if line)
+    failures = (doc_res for doc_res in results if doc_res.get("success") is not True)
+    # Keep a few failures around to log why, only count the rest
+    first_failures = list(islice(failures, 3))
+    fail_count = len(first_failures) + sum(1 for _ in failures)
+    logger.info(
+        f"Indexed {len(doc_batch)} chunks into Typesense collection '{collection_name}', "
+        f"number failed: {fail_count}"
+    )
+    if first_failures:
+        logger.warning(
+            "Typesense import failure reasons: "
+            f"{[doc_res.get('error') for doc_res in first_failures]}"
+        )
 
 
-def index_typesense_chunks(
+def _build_typesense_documents(
+    chunks: list[IndexChunk | EmbeddedIndexChunk],
+    chunk_uuids: list[str],
+    doc_fields: dict[str, dict[str, Any]],
+) -> list[bytes]:
+    """Serializes the chunks into JSONL lines for the import endpoint"""
+    return [
+        orjson.dumps(
+            {
+                # No minichunks for typesense
+                "id": chunk_uuid,
+                CHUNK_ID: chunk.chunk_id,
+                BLURB: chunk.blurb,
+                CONTENT: chunk.content,
+                SOURCE_LINKS: orjson.dumps(
+                    chunk.source_links, option=orjson.OPT_NON_STR_KEYS
+                ).decode(),
+                SECTION_CONTINUATION: chunk.section_continuation,
+                **doc_fields[chunk.source_document.id],
+            }
+        )
+        for chunk, chunk_uuid in zip(chunks, chunk_uuids)
+    ]
+
+
+async def index_typesense_chunks(
     chunks: list[IndexChunk | EmbeddedIndexChunk],
     user_id: UUID | None,
     collection: str,
-    client: typesense.Client | None = None,
+    client: httpx.AsyncClient,
     batch_upsert: bool = True,
 ) -> int:
     user_str = PUBLIC_DOC_PAT if user_id is None else str(user_id)
-    ts_client: typesense.Client = client if client else get_typesense_client()
+    ts_client = client
+
+    # Each chunk's id is derived once and reused for the whitelists and the documents
+    chunk_uuids = [str(get_uuid_from_chunk(chunk)) for chunk in chunks]
+
+    existing_whitelists = await get_typesense_document_whitelists(
+        get_first_chunk_ids(chunks, chunk_uuids), collection, ts_client
+    )
 
-    new_documents: list[dict[str, Any]] = []
     doc_user_map: dict[str, dict[str, list[str]]] = {}
-    docs_deleted = 0
-    for chunk in chunks:
+    docs_to_delete: list[str] = []
+    # Number of chunks each document now has, any chunk past that is stale
+    doc_num_chunks: dict[str, int] = {}
+    # Fields shared by all chunks of a document are only built for its first chunk
+    doc_fields: dict[str, dict[str, Any]] = {}
+    for chunk, chunk_uuid in zip(chunks, chunk_uuids):
         document = chunk.source_document
+        document_id = document.id
+        doc_num_chunks[document_id] = max(
+            doc_num_chunks.get(document_id, 0), chunk.chunk_id + 1
+        )
+        if document_id in doc_fields:
+            continue
+
         doc_user_map, delete_doc = update_doc_user_map(
             chunk,
             doc_user_map,
-            partial(
-                get_typesense_document_whitelists,
-                collection_name=collection,
-                ts_client=ts_client,
-            ),
+            existing_whitelists,
             user_str,
+            precomputed_uuid=chunk_uuid,
         )
 
         if delete_doc:
             # Processing the first chunk of the doc and the doc exists
-            docs_deleted += 1
-            delete_typesense_doc_chunks(document.id, collection, ts_client)
+            docs_to_delete.append(document_id)
 
-        new_documents.append(
-            {
-                "id": str(get_uuid_from_chunk(chunk)),  # No minichunks for typesense
-                DOCUMENT_ID: document.id,
-                CHUNK_ID: chunk.chunk_id,
-                BLURB: chunk.blurb,
-                CONTENT: chunk.content,
-                SOURCE_TYPE: str(document.source.value),
-                SOURCE_LINKS: json.dumps(chunk.source_links),
-                SEMANTIC_IDENTIFIER: document.semantic_identifier,
-                SECTION_CONTINUATION: chunk.section_continuation,
-                ALLOWED_USERS: doc_user_map[document.id][ALLOWED_USERS],
-                ALLOWED_GROUPS: doc_user_map[document.id][ALLOWED_GROUPS],
-            }
-        )
+        doc_whitelists = doc_user_map[document_id]
+        doc_fields[document_id] = {
+            DOCUMENT_ID: document_id,
+            SOURCE_TYPE: str(document.source.value),
+            SEMANTIC_IDENTIFIER: document.semantic_identifier,
+            ALLOWED_USERS: doc_whitelists[ALLOWED_USERS],
+            ALLOWED_GROUPS: doc_whitelists[ALLOWED_GROUPS],
+        }
 
-    if batch_upsert:
-        doc_batches = [
-            new_documents[x : x + DEFAULT_BATCH_SIZE]
-            for x in range(0, len(new_documents), DEFAULT_BATCH_SIZE)
-        ]
-        for doc_batch in doc_batches:
-            results = ts_client.collections[collection].documents.import_(
-                doc_batch, {"action": "upsert"}
-            )
-            failures = [
-                doc_res["success"]
-                for doc_res in results
-                if doc_res["success"] is not True
-            ]
-            logger.info(
-                f"Indexed {len(doc_batch)} chunks into Typesense collection '{collection}', "
-                f"number failed: {len(failures)}"
-            )
-    else:
-        [
-            ts_client.collections[collection].documents.upsert(document)
-            for document in new_documents
-        ]
+    # Chunk ids are deterministic per document and chunk index so the new chunks
+    # overwrite the old ones in place, only the chunks past the new end are wiped.
+    # These never overlap with the imports so the deletions run alongside them.
+    docs_by_num_chunks: dict[int, list[str]] = defaultdict(list)
+    for document_id in docs_to_delete:
+        docs_by_num_chunks[doc_num_chunks[document_id]].append(document_id)
 
-    return len(doc_user_map.keys()) - docs_deleted
+    # Always go through the import endpoint, without batch upsert everything is sent at once
+    batch_size = TYPESENSE_IMPORT_BATCH_SIZE if batch_upsert else max(len(chunks), 1)
+    import_limiter = asyncio.Semaphore(TYPESENSE_IMPORT_CONCURRENCY)
+    try:
+        # The first failure cancels the requests still in flight
+        async with asyncio.TaskGroup() as task_group:
+            for num_chunks, document_ids in docs_by_num_chunks.items():
+                task_group.create_task(
+                    delete_typesense_doc_chunks(
+                        document_ids, collection, ts_client, min_chunk_id=num_chunks
+                    )
+                )
+            for x in range(0, len(chunks), batch_size):
+                # Serialized off the event loop so the imports already dispatched keep
+                # being sent while the next batch is built
+                doc_batch = await asyncio.to_thread(
+                    _build_typesense_documents,
+                    chunks[x : x + batch_size],
+                    chunk_uuids[x : x + batch_size],
+                    doc_fields,
+                )
+                task_group.create_task(
+                    _import_typesense_batch(
+                        doc_batch, collection, ts_client, import_limiter
+                    )
+                )
+    except ExceptionGroup as e:
+        # Callers expect the original error, not the group
+        raise e.exceptions[0]
 
+    return len(doc_user_map.keys()) - len(docs_to_delete)
 
-def _build_typesense_filters(
-    user_id: UUID | None, filters: list[IndexFilter] | None
-) -> str:
-    filter_str = ""
 
+# Permission filters only vary by user so they are prepared at import time
+_PUBLIC_ACL_FILTER = f"{ALLOWED_USERS}:={PUBLIC_DOC_PAT}"
+_USER_ACL_FILTER_TMPL = f"{ALLOWED_USERS}:=[{PUBLIC_DOC_PAT},%s]"
+
+# Hashable form of a list of IndexFilter, list values become tuples
+FiltersKey = tuple[tuple[str, str | tuple[str, ...]], ...]
+
+
+def _filters_key(filters: list[IndexFilter] | None) -> FiltersKey:
+    """Flattens the filters into a hashable key, ordered by filter name so equivalent
+    filter combinations share a key. None values are dropped as they do not filter."""
+    filter_items: list[tuple[str, str | tuple[str, ...]]] = []
+    for filter_dict in filters or []:
+        for filter_key, filter_val in filter_dict.items():
+            if filter_val is None:
+                continue
+            if isinstance(filter_val, str):
+                filter_items.append((filter_key, filter_val))
+            elif isinstance(filter_val, list):
+                filter_items.append((filter_key, tuple(filter_val)))
+            else:
+                raise ValueError("Invalid filters provided")
+    return tuple(sorted(filter_items, key=lambda item: item[0]))
+
+
+@lru_cache(maxsize=1024)
+def _build_typesense_filters_from_key(
+    user_id: UUID | None, filters_key: FiltersKey
+) -> str:
     # Permissions filter
-    if user_id:
-        filter_str += f"{ALLOWED_USERS}:=[{PUBLIC_DOC_PAT},{user_id}] && "
-    else:
-        filter_str += f"{ALLOWED_USERS}:={PUBLIC_DOC_PAT} && "
+    filter_parts = [_USER_ACL_FILTER_TMPL % user_id if user_id else _PUBLIC_ACL_FILTER]
 
     # Provided query filters
-    if filters:
-        for filter_dict in filters:
-            valid_filters = {
-                key: value for key, value in filter_dict.items() if value is not None
-            }
-            for filter_key, filter_val in valid_filters.items():
-                if isinstance(filter_val, str):
-                    filter_str += f"{filter_key}:={filter_val} && "
-                elif isinstance(filter_val, list):
-                    filters_or = ",".join([str(f_val) for f_val in filter_val])
-                    filter_str += f"{filter_key}:=[{filters_or}] && "
-                else:
-                    raise ValueError("Invalid filters provided")
-    if filter_str[-4:] == " && ":
-        filter_str = filter_str[:-4]
-    return filter_str
+    for filter_key, filter_val in filters_key:
+        if isinstance(filter_val, str):
+            filter_parts.append(f"{filter_key}:={filter_val}")
+        else:
+            filters_or = ",".join(map(str, filter_val))
+            filter_parts.append(f"{filter_key}:=[{filters_or}]")
+    return " && ".join(filter_parts)
+
+
+def _build_typesense_filters(
+    user_id: UUID | None, filters: list[IndexFilter] | None
+) -> str:
+    # Output only depends on the inputs so repeated filter combinations are served from cache
+    return _build_typesense_filters_from_key(user_id, _filters_key(filters))
 
 
 class TypesenseIndex(KeywordIndex):
@@ -205,11 +390,16 @@ class TypesenseIndex(KeywordIndex):
         self.ts_client = get_typesense_client()
 
     def index(self, chunks: list[IndexChunk], user_id: UUID | None) -> int:
-        return index_typesense_chunks(
-            chunks=chunks,
-            user_id=user_id,
-            collection=self.collection,
-            client=self.ts_client,
+        """Sync interface, blocks the calling thread until the chunks are indexed. The work runs
+        on the shared Typesense event loop thread so this is safe to call with a running loop,
+        async code should still call it via run_in_executor to not block its loop."""
+        return run_on_typesense_loop(
+            index_typesense_chunks(
+                chunks=chunks,
+                user_id=user_id,
+                collection=self.collection,
+                client=get_typesense_async_client(),
+            )
         )
 
     def keyword_search(
@@ -218,6 +408,8 @@ class TypesenseIndex(KeywordIndex):
         user_id: UUID | None,
         filters: list[IndexFilter] | None,
         num_to_retrieve: int,
+        num_typos: int = 2,
+        prefix: bool = False,
     ) -> list[InferenceChunk]:
         filters_str = _build_typesense_filters(user_id, filters)
 
@@ -227,7 +419,12 @@ class TypesenseIndex(KeywordIndex):
             "filter_by": filters_str,
             "per_page": num_to_retrieve,
             "limit_hits": num_to_retrieve,
-            "num_typos": 2,
+            # Typesense already scales typo tolerance down for short tokens (min_len_1typo
+            # and min_len_2typo), this is only the upper bound
+            "num_typos": num_typos,
+            # Queries are whole lemmatized words, no need to prefix match the last one
+            "prefix": "true" if prefix else "false",
+            "include_fields": _INFERENCE_CHUNK_FIELDS,
         }
 
         search_results = self.ts_client.collections[self.collection].documents.search(
@@ -235,6 +432,4 @@ class TypesenseIndex(KeywordIndex):
         )
 
         hits = search_results["hits"]
-        inference_chunks = [InferenceChunk.from_dict(hit["document"]) for hit in hits]
-
-        return inference_chunks
+        return [InferenceChunk.from_dict(hit["document"]) for hit in hits]
@@ -1,3 +1,12 @@
+import asyncio
+import threading
+from collections.abc import Callable
+from collections.abc import Coroutine
+from typing import Any
+from typing import TypeVar
+
+import httpx
+import requests
 import typesense  # type: ignore
 from danswer.configs.app_configs import QDRANT_API_KEY
 from danswer.configs.app_configs import QDRANT_HOST
@@ -7,10 +16,71 @@ from danswer.configs.app_configs import TYPESENSE_API_KEY
 from danswer.configs.app_configs import TYPESENSE_HOST
 from danswer.configs.app_configs import TYPESENSE_PORT
 from qdrant_client import QdrantClient
+from requests.adapters import HTTPAdapter
+from typesense.aliases import Aliases  # type: ignore
+from typesense.api_call import ApiCall  # type: ignore
+from typesense.collections import Collections  # type: ignore
+from typesense.configuration import Configuration  # type: ignore
+from typesense.debug import Debug  # type: ignore
+from typesense.keys import Keys  # type: ignore
+from typesense.multi_search import MultiSearch  # type: ignore
+from typesense.operations import Operations  # type: ignore
 
 
 _qdrant_client: QdrantClient | None = None
 _typesense_client: typesense.Client | None = None
+# Ingestion goes through one async client living on its own event loop thread so its
+# connections are kept alive across index calls
+_typesense_async_client: httpx.AsyncClient | None = None
+_typesense_loop: asyncio.AbstractEventLoop | None = None
+_typesense_loop_lock = threading.Lock()
+
+T = TypeVar("T")
+
+_TYPESENSE_TIMEOUT_SECONDS = 3.0
+_TYPESENSE_NUM_RETRIES = 3
+_TYPESENSE_RETRY_INTERVAL_SECONDS = 1.0
+
+_TYPESENSE_POOL_CONNECTIONS = 32
+_TYPESENSE_POOL_MAXSIZE = 64
+
+
+class _PooledTypesenseApiCall(ApiCall):
+    """The typesense library sends each request through the module level requests functions,
+    which opens a new connection every call. This reuses keep-alive connections instead.
+    """
+
+    def __init__(self, config: Configuration) -> None:
+        super().__init__(config)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=_TYPESENSE_POOL_CONNECTIONS,
+            pool_maxsize=_TYPESENSE_POOL_MAXSIZE,
+            pool_block=False,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def make_request(
+        self, fn: Callable, endpoint: str, as_json: bool, **kwargs: Any
+    ) -> Any:
+        # fn is one of requests.get/post/put/patch/delete, swap in the session's version
+        return super().make_request(
+            getattr(self.session, fn.__name__), endpoint, as_json, **kwargs
+        )
+
+
+class _PooledTypesenseClient(typesense.Client):
+    def __init__(self, config_dict: dict[str, Any]) -> None:
+        # Mirrors typesense.Client.__init__ but with the pooled ApiCall
+        self.config = Configuration(config_dict)
+        self.api_call = _PooledTypesenseApiCall(self.config)
+        self.collections = Collections(self.api_call)
+        self.multi_search = MultiSearch(self.api_call)
+        self.keys = Keys(self.api_call)
+        self.aliases = Aliases(self.api_call)
+        self.operations = Operations(self.api_call)
+        self.debug = Debug(self.api_call)
 
 
 def get_qdrant_client() -> QdrantClient:
@@ -30,7 +100,7 @@ def get_typesense_client() -> typesense.Client:
     global _typesense_client
     if _typesense_client is None:
         if TYPESENSE_HOST and TYPESENSE_PORT and TYPESENSE_API_KEY:
-            _typesense_client = typesense.Client(
+            _typesense_client = _PooledTypesenseClient(
                 {
                     "api_key": TYPESENSE_API_KEY,
                     "nodes": [
@@ -40,9 +110,70 @@ def get_typesense_client() -> typesense.Client:
                             "protocol": "http",
                         }
                     ],
+                    "connection_timeout_seconds": _TYPESENSE_TIMEOUT_SECONDS,
+                    "num_retries": _TYPESENSE_NUM_RETRIES,
                 }
             )
         else:
             raise Exception("Unable to instantiate TypesenseClient")
 
     return _typesense_client
+
+
+def _get_typesense_loop() -> asyncio.AbstractEventLoop:
+    global _typesense_loop
+    with _typesense_loop_lock:
+        if _typesense_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="typesense-io", daemon=True
+            ).start()
+            _typesense_loop = loop
+    return _typesense_loop
+
+
+def get_typesense_async_client() -> httpx.AsyncClient:
+    """The httpx.AsyncClient is bound to the event loop it is first used on, so it must only
+    be used in coroutines passed to run_on_typesense_loop"""
+    global _typesense_async_client
+    with _typesense_loop_lock:
+        if _typesense_async_client is None:
+            if TYPESENSE_HOST and TYPESENSE_PORT and TYPESENSE_API_KEY:
+                _typesense_async_client = httpx.AsyncClient(
+                    base_url=f"http://{TYPESENSE_HOST}:{TYPESENSE_PORT}",
+                    headers={"X-TYPESENSE-API-KEY": TYPESENSE_API_KEY},
+                    # Same timeout as the sync client above, retries are done by
+                    # send_typesense_request
+                    timeout=_TYPESENSE_TIMEOUT_SECONDS,
+                    # The client ignores its own limits when a transport is given
+                    transport=httpx.AsyncHTTPTransport(
+                        limits=httpx.Limits(max_connections=64)
+                    ),
+                )
+            else:
+                raise Exception("Unable to instantiate Typesense AsyncClient")
+
+    return _typesense_async_client
+
+
+async def send_typesense_request(
+    ts_client: httpx.AsyncClient, method: str, url: str, **kwargs: Any
+) -> httpx.Response:
+    """Retries like the sync typesense client does: on timeouts, connection errors and
+    5xx responses, waiting between tries. Other responses are returned as is."""
+    for _ in range(_TYPESENSE_NUM_RETRIES):
+        try:
+            response = await ts_client.request(method, url, **kwargs)
+            if response.status_code < 500:
+                return response
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(_TYPESENSE_RETRY_INTERVAL_SECONDS)
+    return await ts_client.request(method, url, **kwargs)
+
+
+def run_on_typesense_loop(coro: Coroutine[Any, Any, T]) -> T:
+    """Runs the coroutine on the long lived Typesense event loop thread and blocks the calling
+    thread until it is done. Works whether or not the caller has an event loop running, but
+    async callers should call this via run_in_executor to not block their own loop."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_typesense_loop()).result()
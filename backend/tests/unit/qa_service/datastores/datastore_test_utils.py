@@ -0,0 +1,25 @@
+from danswer.chunking.models import IndexChunk
+from danswer.configs.constants import DocumentSource
+from danswer.connectors.models import Document
+from danswer.connectors.models import Section
+
+
+def make_chunk(document_id: str, chunk_id: int) -> IndexChunk:
+    return IndexChunk(
+        chunk_id=chunk_id,
+        blurb="blurb",
+        content="content",
+        source_links={0: "https://www.test.com/"},
+        section_continuation=False,
+        source_document=Document(
+            id=document_id,
+            sections=[Section(text="text", link="https://www.test.com/")],
+            source=DocumentSource.WEB,
+            semantic_identifier=document_id,
+            metadata={},
+        ),
+    )
+
+
+def make_doc_chunks(document_id: str, num_chunks: int) -> list[IndexChunk]:
+    return [make_chunk(document_id, chunk_id) for chunk_id in range(num_chunks)]
@@ -0,0 +1,80 @@
+import unittest
+
+from danswer.configs.constants import ALLOWED_GROUPS
+from danswer.configs.constants import ALLOWED_USERS
+from danswer.datastores.datastore_utils import ChunkWhitelistMap
+from danswer.datastores.datastore_utils import get_first_chunk_ids
+from danswer.datastores.datastore_utils import get_uuid_from_chunk
+from danswer.datastores.datastore_utils import update_doc_user_map
+from datastore_test_utils import make_chunk
+
+
+class TestGetFirstChunkIds(unittest.TestCase):
+    def test_order_and_dedup(self) -> None:
+        chunks = [
+            make_chunk("doc_b", 0),
+            make_chunk("doc_b", 1),
+            make_chunk("doc_a", 0),
+            make_chunk("doc_b", 2),
+            make_chunk("doc_a", 1),
+        ]
+        expected = [
+            str(get_uuid_from_chunk(chunks[0])),
+            str(get_uuid_from_chunk(chunks[2])),
+        ]
+        self.assertEqual(get_first_chunk_ids(chunks), expected)
+
+    def test_precomputed_uuids(self) -> None:
+        chunks = [make_chunk("doc_a", 0), make_chunk("doc_a", 1)]
+        self.assertEqual(get_first_chunk_ids(chunks, ["id_0", "id_1"]), ["id_0"])
+
+
+class TestUpdateDocUserMap(unittest.TestCase):
+    def test_missing_document(self) -> None:
+        chunk = make_chunk("doc_a", 0)
+        doc_user_map, delete_doc = update_doc_user_map(chunk, {}, {}, "user")
+        self.assertFalse(delete_doc)
+        self.assertEqual(
+            doc_user_map, {"doc_a": {ALLOWED_USERS: ["user"], ALLOWED_GROUPS: []}}
+        )
+
+    def test_existing_document(self) -> None:
+        chunk = make_chunk("doc_a", 0)
+        existing_whitelists: ChunkWhitelistMap = {
+            str(get_uuid_from_chunk(chunk)): (["other_user"], ["group"])
+        }
+        doc_user_map, delete_doc = update_doc_user_map(
+            chunk, {}, existing_whitelists, "user"
+        )
+        self.assertTrue(delete_doc)
+        self.assertEqual(
+            doc_user_map,
+            {
+                "doc_a": {
+                    ALLOWED_USERS: ["other_user", "user"],
+                    ALLOWED_GROUPS: ["group"],
+                }
+            },
+        )
+
+        # Later chunks of the same document don't trigger another deletion
+        doc_user_map, delete_doc = update_doc_user_map(
+            make_chunk("doc_a", 1), doc_user_map, existing_whitelists, "user"
+        )
+        self.assertFalse(delete_doc)
+
+    def test_existing_whitelists_not_mutated(self) -> None:
+        chunk = make_chunk("doc_a", 0)
+        users = ["other_user"]
+        groups = ["group"]
+        existing_whitelists: ChunkWhitelistMap = {
+            str(get_uuid_from_chunk(chunk)): (users, groups)
+        }
+        doc_user_map, _ = update_doc_user_map(chunk, {}, existing_whitelists, "user")
+        doc_user_map["doc_a"][ALLOWED_GROUPS].append("new_group")
+        self.assertEqual(users, ["other_user"])
+        self.assertEqual(groups, ["group"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from uuid import UUID
+
+from danswer.configs.constants import ALLOWED_USERS
+from danswer.configs.constants import PUBLIC_DOC_PAT
+from danswer.configs.constants import SOURCE_TYPE
+from danswer.datastores.typesense.store import _build_typesense_filters
+
+
+class TestBuildTypesenseFilters(unittest.TestCase):
+    def test_public_only(self) -> None:
+        self.assertEqual(
+            _build_typesense_filters(None, None), f"{ALLOWED_USERS}:={PUBLIC_DOC_PAT}"
+        )
+
+    def test_user_and_filters(self) -> None:
+        user_id = UUID(int=1)
+        filters_str = _build_typesense_filters(
+            user_id,
+            [{SOURCE_TYPE: ["web", "slack"], "unset": None}, {"document_id": "doc"}],
+        )
+        self.assertEqual(
+            filters_str,
+            f"{ALLOWED_USERS}:=[{PUBLIC_DOC_PAT},{user_id}] && "
+            f"document_id:=doc && {SOURCE_TYPE}:=[web,slack]",
+        )
+
+    def test_invalid_filter(self) -> None:
+        with self.assertRaises(ValueError):
+            _build_typesense_filters(None, [{SOURCE_TYPE: 1}])  # type: ignore
+
+
+if __name__ == "__main__":
+    unittest.main()
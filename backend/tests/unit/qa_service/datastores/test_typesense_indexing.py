@@ -0,0 +1,235 @@
+import json
+import unittest
+from collections.abc import Callable
+from unittest.mock import patch
+
+import httpx
+from danswer.configs.constants import ALLOWED_GROUPS
+from danswer.configs.constants import ALLOWED_USERS
+from danswer.datastores.datastore_utils import get_uuid_from_chunk
+from danswer.datastores.typesense.store import get_typesense_document_whitelists
+from danswer.datastores.typesense.store import index_typesense_chunks
+from datastore_test_utils import make_doc_chunks
+
+
+RequestHandler = Callable[[httpx.Request], httpx.Response]
+
+
+class _MockTypesense:
+    """Records the requests made and answers them with the given handler"""
+
+    def __init__(self, handler: RequestHandler) -> None:
+        self.requests: list[httpx.Request] = []
+        self.handler = handler
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        return self.handler(request)
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url="http://typesense", transport=httpx.MockTransport(self)
+        )
+
+
+def _whitelist_hit(chunk_id: str) -> dict:
+    return {
+        "document": {
+            "id": chunk_id,
+            ALLOWED_USERS: ["user"],
+            ALLOWED_GROUPS: ["group"],
+        }
+    }
+
+
+class TestTypesenseDocumentWhitelists(unittest.IsolatedAsyncioTestCase):
+    async def test_no_ids(self) -> None:
+        mock_ts = _MockTypesense(lambda request: httpx.Response(500))
+        async with mock_ts.client() as ts_client:
+            whitelists = await get_typesense_document_whitelists([], "col", ts_client)
+        self.assertEqual(whitelists, {})
+        self.assertEqual(mock_ts.requests, [])
+
+    async def test_found_chunks(self) -> None:
+        mock_ts = _MockTypesense(
+            lambda request: httpx.Response(
+                200, json={"results": [{"hits": [_whitelist_hit("a")]}]}
+            )
+        )
+        async with mock_ts.client() as ts_client:
+            whitelists = await get_typesense_document_whitelists(
+                ["a", "b"], "col", ts_client
+            )
+        self.assertEqual(whitelists, {"a": (["user"], ["group"])})
+        self.assertEqual(len(mock_ts.requests), 1)
+        (search,) = json.loads(mock_ts.requests[0].content)["searches"]
+        self.assertEqual(search["filter_by"], "id:=[a,b]")
+
+    async def test_splits_searches_by_page_size(self) -> None:
+        chunk_ids = [f"id_{ind}" for ind in range(251)]
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            searches = json.loads(request.content)["searches"]
+            return httpx.Response(
+                200, json={"results": [{"hits": []} for _ in searches]}
+            )
+
+        mock_ts = _MockTypesense(handler)
+        async with mock_ts.client() as ts_client:
+            await get_typesense_document_whitelists(chunk_ids, "col", ts_client)
+        self.assertEqual(len(mock_ts.requests), 1)
+        searches = json.loads(mock_ts.requests[0].content)["searches"]
+        self.assertEqual([search["per_page"] for search in searches], [250, 1])
+        self.assertEqual(searches[1]["filter_by"], "id:=[id_250]")
+
+    async def test_search_error(self) -> None:
+        mock_ts = _MockTypesense(
+            lambda request: httpx.Response(
+                200, json={"results": [{"error": "bad filter", "code": 400}]}
+            )
+        )
+        async with mock_ts.client() as ts_client:
+            with self.assertRaises(RuntimeError):
+                await get_typesense_document_whitelists(["a"], "col", ts_client)
+
+    @patch("danswer.utils.clients._TYPESENSE_RETRY_INTERVAL_SECONDS", 0)
+    async def test_retries_server_errors(self) -> None:
+        responses = [
+            httpx.Response(503),
+            httpx.Response(200, json={"results": [{"hits": [_whitelist_hit("a")]}]}),
+        ]
+        mock_ts = _MockTypesense(lambda request: responses.pop(0))
+        async with mock_ts.client() as ts_client:
+            whitelists = await get_typesense_document_whitelists(
+                ["a"], "col", ts_client
+            )
+        self.assertEqual(whitelists, {"a": (["user"], ["group"])})
+        self.assertEqual(len(mock_ts.requests), 2)
+
+    @patch("danswer.utils.clients._TYPESENSE_RETRY_INTERVAL_SECONDS", 0)
+    async def test_gives_up_after_retries(self) -> None:
+        mock_ts = _MockTypesense(lambda request: httpx.Response(503))
+        async with mock_ts.client() as ts_client:
+            with self.assertRaises(httpx.HTTPStatusError):
+                await get_typesense_document_whitelists(["a"], "col", ts_client)
+        self.assertEqual(len(mock_ts.requests), 4)
+
+    async def test_missing_access_lists(self) -> None:
+        mock_ts = _MockTypesense(
+            lambda request: httpx.Response(
+                200, json={"results": [{"hits": [{"document": {"id": "a"}}]}]}
+            )
+        )
+        async with mock_ts.client() as ts_client:
+            with self.assertRaises(RuntimeError):
+                await get_typesense_document_whitelists(["a"], "col", ts_client)
+
+
+def _indexing_handler(existing_chunk_ids: set[str]) -> RequestHandler:
+    """Answers the whitelist lookup with the existing chunks and accepts every write"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/multi_search":
+            searches = json.loads(request.content)["searches"]
+            requested_ids = {
+                chunk_id
+                for search in searches
+                for chunk_id in search["filter_by"][len("id:=[") : -1].split(",")
+            }
+            hits = [
+                _whitelist_hit(chunk_id)
+                for chunk_id in sorted(requested_ids & existing_chunk_ids)
+            ]
+            return httpx.Response(200, json={"results": [{"hits": hits}]})
+        if request.method == "DELETE":
+            return httpx.Response(200, json={"num_deleted": 1})
+        if request.url.path.endswith("/documents/import"):
+            num_docs = len(request.content.splitlines())
+            return httpx.Response(
+                200, content=b"\n".join([b'{"success":true}'] * num_docs)
+            )
+        return httpx.Response(404)
+
+    return handler
+
+
+class TestIndexTypesenseChunks(unittest.IsolatedAsyncioTestCase):
+    async def test_reindex_deletes_only_stale_chunks(self) -> None:
+        doc_a = make_doc_chunks("doc_a", 2)
+        doc_b = make_doc_chunks("https://www.test.com/doc_b", 2)
+        doc_c = make_doc_chunks("doc_c", 3)
+        doc_d = make_doc_chunks("doc_d", 1)
+        existing_chunk_ids = {
+            str(get_uuid_from_chunk(doc_chunks[0]))
+            for doc_chunks in (doc_a, doc_b, doc_c)
+        }
+        mock_ts = _MockTypesense(_indexing_handler(existing_chunk_ids))
+
+        async with mock_ts.client() as ts_client:
+            net_new_docs = await index_typesense_chunks(
+                doc_a + doc_b + doc_c + doc_d, None, "col", ts_client
+            )
+
+        # Only doc_d did not exist before
+        self.assertEqual(net_new_docs, 1)
+        delete_filters = sorted(
+            request.url.params["filter_by"]
+            for request in mock_ts.requests
+            if request.method == "DELETE"
+        )
+        # Documents are grouped by their new number of chunks
+        self.assertEqual(
+            delete_filters,
+            [
+                "document_id:=[`doc_a`,`https://www.test.com/doc_b`] && chunk_id:>=2",
+                "document_id:=[`doc_c`] && chunk_id:>=3",
+            ],
+        )
+        imported_ids = [
+            json.loads(line)["id"]
+            for request in mock_ts.requests
+            if request.url.path.endswith("/documents/import")
+            for line in request.content.splitlines()
+        ]
+        self.assertEqual(
+            sorted(imported_ids),
+            sorted(
+                str(get_uuid_from_chunk(chunk))
+                for chunk in doc_a + doc_b + doc_c + doc_d
+            ),
+        )
+
+    async def test_new_documents_not_deleted(self) -> None:
+        mock_ts = _MockTypesense(_indexing_handler(set()))
+
+        async with mock_ts.client() as ts_client:
+            net_new_docs = await index_typesense_chunks(
+                make_doc_chunks("doc_a", 2) + make_doc_chunks("doc_b", 1),
+                None,
+                "col",
+                ts_client,
+            )
+
+        self.assertEqual(net_new_docs, 2)
+        self.assertFalse(
+            any(request.method == "DELETE" for request in mock_ts.requests)
+        )
+
+    async def test_import_failure_raised(self) -> None:
+        handler = _indexing_handler(set())
+
+        def failing_import_handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path.endswith("/documents/import"):
+                return httpx.Response(400)
+            return handler(request)
+
+        mock_ts = _MockTypesense(failing_import_handler)
+        async with mock_ts.client() as ts_client:
+            with self.assertRaises(httpx.HTTPStatusError):
+                await index_typesense_chunks(
+                    make_doc_chunks("doc_a", 2), None, "col", ts_client
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()